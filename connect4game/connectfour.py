@@ -1,6 +1,6 @@
 # The board is 6 height x 7 width
-from vision import Vision
-from connect4game.robot import Robot
+from connect4game.vision.vision import Vision
+from connect4game.robot.robot import Robot
 from connect4game.utils.logging import create_logger
 import numpy as np
 import time
@@ -154,7 +154,8 @@ class ConnectFour:
                     best_val = move_val
 
         # Best move has been calculated, we ask the robot to place the coin
-        self.robot.drop_piece_to_board(best_col)
+        # Go home after the move so the arm is out of the way during the player's turn
+        self.robot.drop_piece_to_board(best_col, return_home=True)
         self.place_coin(best_col, "RED")
         # Return a value in the future for Robot
 
@@ -3,4 +3,11 @@ from enum import Enum, unique
 @unique
 class GripperAction(Enum):
     OPEN = 0
-    CLOSE = 1
\ No newline at end of file
+    CLOSE = 1
+
+
+# Phases of a drop to a gameboard column, the value is the offset in the flat board position tuple
+@unique
+class BoardPhase(Enum):
+    APPROACH = 0
+    DROP = 1
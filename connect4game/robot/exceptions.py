@@ -0,0 +1,3 @@
+# Raised when a robot action keeps failing with ros timeouts, most likely the robot is not reachable
+class RobotActionTimeout(Exception):
+    pass
@@ -1,9 +1,13 @@
+import logging
+import queue
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from random import randrange
 
-from .enums import GripperAction
+from .enums import BoardPhase, GripperAction
+from .exceptions import RobotActionTimeout
 from pyniryo import NiryoRobot as OldAPI
 from pyniryo2 import ConveyorDirection, NiryoRobot, PoseObject
 from roslibpy.core import RosTimeoutError
@@ -49,6 +53,14 @@ class Robot:
     __BOARD_MOVE_REL_X = -0.042
     __BOARD_MOVE_REL_Z = -0.050
 
+    # Belt speed in percent and the time needed to move a stack by one place at that speed
+    __BELT_SPEED = 15
+    __BELT_RUN_TIME = 4.3
+
+    # Number of tries and total time in seconds for a robot action failing with the ros timing bug
+    __MAX_ACTION_RETRIES = 5
+    __ACTION_TIMEOUT = 10.0
+
     def __init__(self, robot_ip = "169.254.200.200", simulation=False): # if ip addr is argument not provided then use the ethernet port
         # Logger for the robot
         self.__logger = create_logger(name="ROBOT")
@@ -71,30 +83,58 @@ class Robot:
         self.__logger.info("Make sure the area around the robot is clear")
         time.sleep(5)
 
+        # Poses queued by __batch, None while moves are sent one by one
+        self.__pending_poses = None
+
+        # Batched poses are sent through the trajectory api
+        self.__trajectories = self.__robot.trajectories
+
+        # Error of the last failed belt move, raised to anyone waiting for the belt
+        self.__belt_error = None
+
+        # Belt moves are queued and run one after another by a single worker thread
+        # None in the queue stops the worker
+        self.__belt_q = queue.Queue()
+        self.__belt_worker = threading.Thread(target=self.__belt_loop, daemon=True)
+        self.__belt_worker.start()
+
         try:
-            # Calibrate the robot
             self.__arm = self.__robot.arm
-            self.__execute_robot_action(
-                self.__arm.calibrate_auto
-            )
+            self.__tool = self.__robot.tool
+            self.__conveyor = self.__robot.conveyor
+
+            # Keep references to the frequently used actions instead of looking them up on every call
+            self.__move_pose = self.__arm.move_pose
+            self.__move_trajectory = self.__trajectories.execute_trajectory_from_poses
+            self.__grasp = self.__tool.grasp_with_tool
+            self.__release = self.__tool.release_with_tool
+            self.__run_conv = self.__conveyor.run_conveyor
+            self.__stop_conv = self.__conveyor.stop_conveyor
+
+            # Keep the last gripper error state up to date from the hardware status topic
+            # so gripper actions do not have to read the topic every time
+            self.__tool_error = self.__read_tool_error(self.__arm.hardware_status.value)
+            self.__arm.hardware_status.subscribe(self.__on_hardware_status)
+
+            # Calibrate the robot, detect the gripper and set up the conveyor belt at the same time
+            # They use different robot services and do not depend on each other
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                calibration = executor.submit(self.__execute_robot_action, self.__arm.calibrate_auto)
+                tool_update = executor.submit(self.__execute_robot_action, self.__tool.update_tool)
+                conveyor_setup = executor.submit(self.__execute_robot_action, self.__conveyor.set_conveyor)
+
+                calibration.result()
+                tool_update.result()
+                self.__conveyor_id = conveyor_setup.result()
+
             # Move robot to its default position
             self.__move_to_home()
             self.__logger.info("Arm is calibrated and ready to use")
 
-            # Detect the gripper
-            self.__tool = self.__robot.tool
-            self.__execute_robot_action(
-                self.__tool.update_tool
-            )
             # Open the gripper
             self.__control_gripper(GripperAction.OPEN)
             self.__logger.info("Gripper is ready to use")
 
-            # Set up the conveyer belt
-            self.__conveyor = self.__robot.conveyor
-            self.__conveyor_id = self.__execute_robot_action(
-                self.__conveyor.set_conveyor
-            )
             self.__logger.info("Conveyer belt is ready to use")
         except:
             self.__logger.critical("Robot calibration failed!")
@@ -118,6 +158,13 @@ class Robot:
         # Stores the postiion of the first gameboard row
         self.__board_first_pos = None
 
+        # Approach and drop positions of each gameboard column stored flat, see __board_pose
+        # Built once the first row is calibrated
+        self.__board_pos = ()
+
+        # Gameboard columns which alignment is already checked by the user
+        self.__board_calibrated_cols = set()
+
         self.__simulation = simulation
 
     # Returns the current total left pieces on the belt
@@ -139,32 +186,46 @@ class Robot:
         return self.__mag_pos is not None
 
     # Sets up the game, should be called before a game starts
-    # This function makes sure that all pieces are ready on the belt, magazine is ready and the game board is calibrated
+    # This function makes sure that all pieces are ready on the belt, magazine is ready and column 0 of the game board is calibrated
+    # The other columns are checked the first time a piece is dropped to them, drop_piece_to_board will prompt the user then
     def set_up_game(self, piece_count=21, rdy_piece=0, rdy_stack=0):
-        self.__current_piece_count = rdy_piece
-        self.__current_stack_count = rdy_stack
+        try:
+            self.__set_up_game(piece_count, rdy_piece, rdy_stack)
+        except RobotActionTimeout:
+            self.__logger.critical(
+                f"Robot is not responding, game set up aborted with {self.__current_piece_count} pieces "
+                f"and {self.__current_stack_count} pieces on the stack"
+            )
+            raise
+
+    # Counts are kept in local variables and saved to the instance once a piece is on the belt
+    def __set_up_game(self, piece_count, rdy_piece, rdy_stack):
+        pieces = self.__current_piece_count = rdy_piece
+        stack = self.__current_stack_count = rdy_stack
 
         # Move the belt if 2 piece stack is full
-        if self.__current_stack_count == 2 and (self.__current_piece_count != piece_count):
+        if stack == 2 and pieces != piece_count:
             self.__logger.info("Piece stack full moving pieces to the left")
 
-            self.__current_stack_count = 0
-            belt_action = threading.Thread(target=self.__move_pieces_on_belt, args=(ConveyorDirection.BACKWARD,))
-            belt_action.start()
+            stack = self.__current_stack_count = 0
+            self.__belt_q.put(ConveyorDirection.BACKWARD)
 
         # Set up magazine if not already set up
         if not self.is_mag_rdy:
             self.__calibrate_mag()
 
-        while self.__current_piece_count != piece_count:
-            self.__logger.info(f"Currently setting up piece {self.__current_piece_count}")
+        # Set when the arm is left waiting above the magazine after placing a piece
+        at_mag_pre = False
+
+        while pieces != piece_count:
+            self.__logger.info(f"Currently setting up piece {pieces}")
 
             # Determine which place to show to the user
-            self.__logger.info(f"This piece will be placed on position {self.__current_stack_count + 1}")
-            self.__current_piece_count += 1
+            self.__logger.info(f"This piece will be placed on position {stack + 1}")
 
             # Move to magazine to grab a piece
-            self.__move_to_pos(self.__MAG_PRE_POS)
+            if not at_mag_pre:
+                self.__move_to_pos(self.__MAG_PRE_POS)
 
             # Decrease arm speed for precise actions
             with self.__slow_arm_control():
@@ -177,97 +238,125 @@ class Robot:
             # Wait because garbage api decides to execute the next action without completing the first one
             time.sleep(2)
 
-            self.__move_to_home()
-
-            # With the first piece calibrate the gameboard
+            # With the first piece calibrate column 0 of the gameboard
             if not self.is_board_rdy:
+                self.__move_to_home()
                 self.__calibrate_board()
 
-            # Acquire belt control to place the piece
+            # Wait for the queued belt moves then acquire belt control to place the piece
+            self.__wait_for_belt()
             with self.__belt_lock:
                 self.__logger.debug(f"Belt locked by thread {threading.get_ident()}")
 
-                self.__move_to_pos(self.__INDEX0_DROP_POS if self.__current_stack_count==0 else self.__INDEX1_DROP_POS)
-                self.__current_stack_count += 1
+                # Going home and to the belt is sent as a single trajectory
+                with self.__batch():
+                    self.__move_to_home()
+                    self.__move_to_pos(self.__INDEX0_DROP_POS if stack==0 else self.__INDEX1_DROP_POS)
 
                 self.__control_gripper(GripperAction.OPEN)
 
-                # Move to home after piece is placed
-                self.__move_to_home()
+                # The piece is on the belt, save the new counts
+                pieces += 1
+                stack += 1
+                self.__current_piece_count = pieces
+                self.__current_stack_count = stack
+
+                # Leave the belt straight towards the magazine if there are pieces left
+                # so the belt can move while the next piece is grabbed
+                at_mag_pre = pieces != piece_count
+                if at_mag_pre:
+                    self.__move_to_pos(self.__MAG_PRE_POS)
+                else:
+                    self.__move_to_home()
 
                 self.__logger.debug(f"Belt lock removed by thread {threading.get_ident()}")
 
             # Move the belt if 2 piece stack is full
-            if self.__current_stack_count == 2 and (self.__current_piece_count != piece_count):
+            if stack == 2 and pieces != piece_count:
                 self.__logger.info("Piece stack full moving pieces to the left")
 
-                self.__current_stack_count = 0
-                belt_action = threading.Thread(target=self.__move_pieces_on_belt, args=(ConveyorDirection.BACKWARD,))
-                belt_action.start()
+                stack = self.__current_stack_count = 0
+                self.__belt_q.put(ConveyorDirection.BACKWARD)
 
     # Grab the next piece, which piece to grab is calculated automatically
-    def grab_piece(self):
+    # Counts are kept in local variables and saved to the instance once the piece is off the belt
+    # Without return_home the arm leaves the belt straight to the board ref position
+    def grab_piece(self, return_home=False):
         self.__logger.info("Grabing the next piece")
 
+        pieces = self.__current_piece_count
+        stack = self.__current_stack_count
+
         # If there are no pieces left on the belt don't do anything
-        if self.__current_piece_count == 0:
+        if pieces == 0:
             self.__logger.warning("There are no pieces on the belt!")
             return
 
-        # Make sure belt does not move while taking the pieces
-        with self.__belt_lock:
-            self.__logger.debug(f"Belt locked by thread {threading.get_ident()}")
+        try:
+            # Wait for the queued belt moves and make sure belt does not move while taking the pieces
+            self.__wait_for_belt()
+            with self.__belt_lock:
+                self.__logger.debug(f"Belt locked by thread {threading.get_ident()}")
 
-            self.__move_to_pos(self.__INDEX0_DROP_POS if self.__current_stack_count==1 else self.__INDEX1_DROP_POS)
-            self.__control_gripper(GripperAction.CLOSE)
-            self.__move_to_home()
-            self.__current_stack_count -= 1
-            self.__current_piece_count -= 1
+                self.__move_to_pos(self.__INDEX0_DROP_POS if stack==1 else self.__INDEX1_DROP_POS)
+                self.__control_gripper(GripperAction.CLOSE)
 
-            self.__logger.debug(f"Belt lock removed by thread {threading.get_ident()}")
+                # The arm must leave the belt before the lock is released
+                if return_home:
+                    self.__move_to_home()
+                else:
+                    self.__move_to_pos(self.__BOARD_REF)
+
+                # The piece is off the belt, save the new counts
+                stack -= 1
+                pieces -= 1
+                self.__current_stack_count = stack
+                self.__current_piece_count = pieces
+
+                self.__logger.debug(f"Belt lock removed by thread {threading.get_ident()}")
+        except RobotActionTimeout:
+            self.__logger.critical("Robot is not responding, piece grabbing aborted")
+            raise
 
         # If stack is empty then move the new stones on the belt async
-        if self.__current_stack_count == 0 and self.__current_piece_count != 0:
-            self.__current_stack_count = 2
-            belt_thread = threading.Thread(target=self.__move_pieces_on_belt, args=(ConveyorDirection.FORWARD,))
-            belt_thread.start()
+        if stack == 0 and pieces != 0:
+            stack = self.__current_stack_count = 2
+            self.__belt_q.put(ConveyorDirection.FORWARD)
 
         self.__logger.info("Piece grabing action finished")
         self.__logger.info(
             "Currently there"
-            f"{' is 1 piece' if self.__current_stack_count == 1 else f' are {self.__current_stack_count} pieces'} remaining on the stack"
-            f" and there {'is 1 piece' if self.__current_piece_count == 1 else f' are {self.__current_piece_count} pieces'} remaining in total"
+            f"{' is 1 piece' if stack == 1 else f' are {stack} pieces'} remaining on the stack"
+            f" and there {'is 1 piece' if pieces == 1 else f' are {pieces} pieces'} remaining in total"
         )
 
     # Drop the piece to the specified lane starting from 0 upto 6
-    def drop_piece_to_board(self, index):
-        self.grab_piece()
-
+    # Without return_home the arm stays above the board so the next piece can be grabbed right away
+    def drop_piece_to_board(self, index, return_home=False):
         if index > 6 or index < 0:
             self.__logger.error(f"Index {index} is an invalid position for the game board. Use a value between 0-6")
             raise IndexError("Use a value between 0-6")
 
-        self.__logger.info(f"Trying to place the piece on game board row {index}")
+        self.grab_piece()
 
-        # Distance to the row in x axis from the first row
-        self.__move_to_pos(self.__BOARD_REF)
-        current_rel = self.__BOARD_MOVE_REL_X * index
-        row_pos = PoseObject(
-            x=self.__board_first_pos.x + current_rel, y=self.__board_first_pos.y, z=self.__board_first_pos.z,
-            roll=self.__board_first_pos.roll, pitch=self.__board_first_pos.pitch, yaw=self.__board_first_pos.yaw
-        )
+        self.__logger.info(f"Trying to place the piece on game board row {index}")
 
-        # Move towards to the row
-        self.__move_to_pos(row_pos)
+        # Move towards to the row passing by the board ref position
+        with self.__batch():
+            self.__move_to_pos(self.__BOARD_REF)
+            self.__move_to_pos(self.__board_pose(index, BoardPhase.APPROACH))
 
-        # Get down to the row
-        self.__move_relative_linear([0, 0, self.__BOARD_MOVE_REL_Z, 0, 0, 0])
+        # Get down to the row, the first time a column is used let the user check it
+        if index not in self.__board_calibrated_cols:
+            self.__calibrate_column(index)
+        else:
+            self.__move_linear_to_pos(self.__board_pose(index, BoardPhase.DROP))
 
         # Drop the piece to the row
         self.__control_gripper(GripperAction.OPEN)
 
         # Get up from the row
-        self.__move_relative_linear([0, 0, -self.__BOARD_MOVE_REL_Z, 0, 0, 0])
+        self.__move_linear_to_pos(self.__board_pose(index, BoardPhase.APPROACH))
 
         # Move Joint1 to avoid collision with the game board
         current_joints = self.__execute_robot_action(
@@ -278,15 +367,45 @@ class Robot:
 
         self.__move_joints(current_joints)
 
-        self.__move_to_home()
+        if return_home:
+            self.__move_to_home()
 
     # Function to end the control instance, must be called at the end
     def end_robot(self):
         self.__logger.info("Closing all robot api connections")
 
+        # Let the belt finish its queued moves before closing the connection
+        self.__belt_q.put(None)
+        self.__belt_worker.join()
+
         self.__robot.end()
         self.__old_api.close_connection()
 
+    # Worker thread running the queued belt moves
+    def __belt_loop(self):
+        while True:
+            direction = self.__belt_q.get()
+            if direction is None:
+                self.__belt_q.task_done()
+                return
+
+            try:
+                self.__move_pieces_on_belt(direction)
+            except Exception as e:
+                # Keep the worker alive, otherwise anyone waiting for the belt would block forever
+                # The error is raised again to the thread waiting for the belt
+                self.__belt_error = e
+            finally:
+                self.__belt_q.task_done()
+
+    # Wait for the queued belt moves to finish
+    # If a belt move failed the pieces are not where they should be, so raise its error
+    def __wait_for_belt(self):
+        self.__belt_q.join()
+
+        if self.__belt_error is not None:
+            raise self.__belt_error
+
     # Move pieces on the belt
     def __move_pieces_on_belt(self, direction: ConveyorDirection):
         with self.__belt_lock:
@@ -296,88 +415,173 @@ class Robot:
                 f"{'backward' if direction == ConveyorDirection.BACKWARD else 'forward'} direction"
             )
 
-            self.__execute_robot_action(
-                self.__conveyor.run_conveyor, self.__conveyor_id, 15, direction
-            )
-            time.sleep(4.3)
-            self.__execute_robot_action(
-                self.__conveyor.stop_conveyor, self.__conveyor_id
-            )
+            try:
+                self.__execute_robot_action(
+                    self.__run_conv, self.__conveyor_id, self.__BELT_SPEED, direction
+                )
+                # The run time was measured from the moment the start command returns
+                time.sleep(self.__BELT_RUN_TIME)
+            except Exception:
+                # Log the failure now, a failing stop command below would hide it
+                self.__logger.exception("Belt move failed, stopping the belt")
+                raise
+            finally:
+                # Never leave the belt running, even if the start command failed
+                self.__execute_robot_action(
+                    self.__stop_conv, self.__conveyor_id
+                )
 
             self.__logger.debug(f"Belt lock removed by thread {threading.get_ident()}")
 
     # work around ros timing bug where the robot fails sometimes for no reason
-    def __execute_robot_action(self, action, *args):
-        result = None
-
-        # If this is a function get its name
-        # If this is not a function (property) ignore the name since it will throw an exception
-        try:
-            name = action.__name__
-        except AttributeError:
-            name = None
-
-        while True:
+    # Raises RobotActionTimeout if the action keeps failing after max_retries tries or total_timeout seconds
+    def __execute_robot_action(self, action, *args, max_retries=None, total_timeout=None):
+        if max_retries is None:
+            max_retries = self.__MAX_ACTION_RETRIES
+        if total_timeout is None:
+            total_timeout = self.__ACTION_TIMEOUT
+
+        start = time.monotonic()
+        for attempt in range(1, max_retries + 1):
             try:
-                result = action(*args)
+                return action(*args)
             except TypeError:
                 self.__logger.critical("You did a coding error, do not pass function call instead pass a function reference")
                 raise
-            except RosTimeoutError:
+            except RosTimeoutError as e:
+                # If this is a function get its name
+                # If this is not a function (property) there is no name
+                name = getattr(action, "__name__", "...")
+
+                # Give up if the robot keeps timing out, it is most likely unreachable
+                elapsed = time.monotonic() - start
+                if attempt == max_retries or elapsed >= total_timeout:
+                    self.__logger.error(f"Action {name} timed out {attempt} times in {elapsed:.1f} seconds, giving up")
+                    raise RobotActionTimeout(f"Robot action {name} timed out") from e
+
                 # robot internal bug safe to ignore
-                # TODO in the future maybe add a retry limit
-                self.__logger.warning(f"Robot internal timing bug, safe to ignore, retrying action {'...' if name is None else name}")
-                continue
-            break
-        return result
+                self.__logger.warning(f"Robot internal timing bug, safe to ignore, retrying action {name}")
 
     # Function for moving back to the home pose
     def __move_to_home(self):
         self.__move_to_pos(self.__BETTER_HOME_POS)
-        self.__logger.info("Moved to home position")
+
+        # Inside a __batch block the move is only queued at this point
+        if self.__pending_poses is None:
+            self.__logger.info("Moved to home position")
+        else:
+            self.__logger.info("Queued move to home position")
 
     # Move robot to specified position
+    # Inside a __batch block the position is only queued
+    # Movement logs are only formatted when debug logging is enabled since they run on every move
     def __move_to_pos(self, pos: PoseObject):
+        if self.__pending_poses is not None:
+            self.__pending_poses.append(pos)
+
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__logger.debug(
+                    f"Queued position x={pos.x} y={pos.y} z={pos.z} "
+                    f"roll={pos.roll} pitch={pos.pitch} yaw={pos.yaw}"
+                )
+            return
+
         self.__execute_robot_action(
-            self.__arm.move_pose, pos
+            self.__move_pose, pos
         )
         
-        self.__logger.debug(
-            f"Moved to position x={pos.x} y={pos.y} z={pos.z} "
-            f"roll={pos.roll} pitch={pos.pitch} yaw={pos.yaw}"
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug(
+                f"Moved to position x={pos.x} y={pos.y} z={pos.z} "
+                f"roll={pos.roll} pitch={pos.pitch} yaw={pos.yaw}"
+            )
+
+    # Send the queued positions to the robot in one request
+    # Must be called before any action which is not a pose move
+    def __flush_poses(self):
+        if not self.__pending_poses:
+            return
+
+        poses = self.__pending_poses
+        self.__pending_poses = []
+
+        if len(poses) == 1:
+            self.__execute_robot_action(
+                self.__move_pose, poses[0]
+            )
+        else:
+            # The trajectory api expects each pose as [x, y, z, roll, pitch, yaw]
+            self.__execute_robot_action(
+                self.__move_trajectory, [pose.to_list() for pose in poses]
+            )
+
+        self.__logger.debug(f"Executed {len(poses)} queued positions")
+
+    # Queue pose moves and execute them as a single trajectory at the end of the block
+    # Gripper, relative, joint and speed actions flush the queue before running
+    @contextmanager
+    def __batch(self):
+        # Nested batches are merged into the outer one
+        if self.__pending_poses is not None:
+            yield
+            return
+
+        self.__pending_poses = []
+        try:
+            yield
+            self.__flush_poses()
+        finally:
+            self.__pending_poses = None
+
+    # Move robot linearly to specified position
+    def __move_linear_to_pos(self, pos: PoseObject):
+        self.__flush_poses()
+
+        self.__execute_robot_action(
+            self.__arm.move_linear_pose, pos
         )
 
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug(
+                f"Moved linearly to position x={pos.x} y={pos.y} z={pos.z} "
+                f"roll={pos.roll} pitch={pos.pitch} yaw={pos.yaw}"
+            )
+
     def __move_relative_linear(self, relative_arr: list):
+        self.__flush_poses()
+
         self.__execute_robot_action(
             self.__arm.move_linear_relative, relative_arr
         )
 
-        self.__logger.debug(
-            "Moved relative to current position by "
-            f"x->{'%.3f' % relative_arr[0]} y->{'%.3f' % relative_arr[1]} z->{'%.3f' % relative_arr[2]} "
-            f"roll->{'%.3f' % relative_arr[3]} pitch->{'%.3f' % relative_arr[4]} yaw->{'%.3f' % relative_arr[5]}"
-        )
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug(
+                "Moved relative to current position by "
+                f"x->{'%.3f' % relative_arr[0]} y->{'%.3f' % relative_arr[1]} z->{'%.3f' % relative_arr[2]} "
+                f"roll->{'%.3f' % relative_arr[3]} pitch->{'%.3f' % relative_arr[4]} yaw->{'%.3f' % relative_arr[5]}"
+            )
 
     def __move_joints(self, joint_list: list):
+        self.__flush_poses()
+
         self.__execute_robot_action(
             self.__arm.move_joints, joint_list
         )
 
-        self.__logger.debug(
-            "Moved joints to "
-            f"Joint1->{'%.3f' % joint_list[0]} Joint2->{'%.3f' % joint_list[1]} Joint3->{'%.3f' % joint_list[2]} "
-            f"Joint4->{'%.3f' % joint_list[3]} Joint5->{'%.3f' % joint_list[4]} Joint6->{'%.3f' % joint_list[5]}"
-        )
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug(
+                "Moved joints to "
+                f"Joint1->{'%.3f' % joint_list[0]} Joint2->{'%.3f' % joint_list[1]} Joint3->{'%.3f' % joint_list[2]} "
+                f"Joint4->{'%.3f' % joint_list[3]} Joint5->{'%.3f' % joint_list[4]} Joint6->{'%.3f' % joint_list[5]}"
+            )
 
     # Function for restarting gripper in case of hardware error
     # Works well for overheating issue, still can cause unexpected behaviour
     # with the robot, looks stupid but solves the issue
     def __check_gripper_errors(self) -> bool:
         result = False
-        try:
-            # Index for gripper error value
-            tool_state = self.__arm.hardware_status.value.hardware_errors[7]
-        except IndexError:
+        tool_state = self.__tool_error
+        if tool_state is None:
             # While using the simulation this value might not be present
             # If not present give a warning and skip checking for gripper errors
             self.__logger.warning("Gripper error status not readable, skip checking for gripper error")
@@ -405,15 +609,30 @@ class Robot:
             # Wait for hardware state to update
             time.sleep(5)
 
-            try:
-                tool_state = self.__arm.hardware_status.value.hardware_errors[7]
-            except IndexError:
+            tool_state = self.__tool_error
+            if tool_state is None:
                 self.__logger.warning("Gripper error status not readable after tool reboot")
                 return True
 
         return result
 
+    # Returns the gripper error value of a hardware status, None if it is not present
+    @staticmethod
+    def __read_tool_error(hardware_status):
+        try:
+            # Index for gripper error value
+            return hardware_status.hardware_errors[7]
+        except IndexError:
+            return None
+
+    # Callback of the hardware status topic
+    def __on_hardware_status(self, hardware_status):
+        self.__tool_error = self.__read_tool_error(hardware_status)
+
     def __control_gripper(self, action: GripperAction):
+        # Gripper actions can not be part of a trajectory, finish the queued moves first
+        self.__flush_poses()
+
         # Check for gripper errors before doing anything
         # Disregard the result during the first check since the function will fix it already
         self.__check_gripper_errors()
@@ -421,13 +640,13 @@ class Robot:
         while True:
             if action == GripperAction.CLOSE:
                 self.__execute_robot_action(
-                        self.__tool.grasp_with_tool
+                        self.__grasp
                 )
 
                 self.__logger.debug("Gripper close action done")
             else:
                 self.__execute_robot_action(
-                        self.__tool.release_with_tool
+                        self.__release
                 )
 
                 self.__logger.debug("Gripper open action done")
@@ -475,7 +694,7 @@ class Robot:
 
         self.__move_to_home()
 
-    # This function calibrates the place of the game board
+    # This function calibrates the place of the game board using column 0
     def __calibrate_board(self):
         # Calibrate board positions
         self.__move_to_pos(self.__BOARD_REF)
@@ -496,23 +715,22 @@ class Robot:
         self.__board_first_pos = self.__execute_robot_action(
             self.__arm.get_pose
         )
+        self.__board_calibrated_cols.add(0)
 
-        self.__logger.info("Other row's positions will adjusted accordingly to the first row")
-
-        for row in range(6):
-            self.__logger.info(f"Currently calibrating column {(row+1)}")
-
-            self.__move_relative_linear([self.__BOARD_MOVE_REL_X, 0, 0, 0, 0, 0])
-
-            with self.__slow_arm_control():
-                self.__move_relative_linear([0, 0, self.__BOARD_MOVE_REL_Z, 0, 0, 0])
-
-                if not self.__simulation:
-                    # Wait for user confirmation
-                    self.__logger.info("Check if the row is aligned, press enter to continue...")
-                    input()
+        # Distance to the row in x axis from the first row
+        # Drop positions are lower than the approach positions by the board z move
+        first_pos = self.__board_first_pos
+        self.__board_pos = tuple(
+            PoseObject(
+                x=first_pos.x + self.__BOARD_MOVE_REL_X * index, y=first_pos.y, z=first_pos.z + rel_z,
+                roll=first_pos.roll, pitch=first_pos.pitch, yaw=first_pos.yaw
+            )
+            for index in range(7)
+            for rel_z in (0, self.__BOARD_MOVE_REL_Z)
+        )
 
-                self.__move_relative_linear([0, 0, -self.__BOARD_MOVE_REL_Z, 0, 0, 0])
+        self.__logger.info("Other row's positions will adjusted accordingly to the first row")
+        self.__logger.info("Each of them will be checked the first time a piece is dropped there")
 
         # Move only Joint1 to avoid collision with the game board
         current_joints = self.__execute_robot_action(
@@ -525,10 +743,32 @@ class Robot:
 
         self.__move_to_home()
 
+    # Check the alignment of a gameboard column, called the first time a piece is dropped to it
+    # Moves the arm down into the column from above it and leaves it there
+    def __calibrate_column(self, index):
+        self.__logger.info(f"Currently calibrating column {index}")
+
+        with self.__slow_arm_control():
+            self.__move_linear_to_pos(self.__board_pose(index, BoardPhase.DROP))
+
+            if not self.__simulation:
+                # Wait for user confirmation
+                self.__logger.info("Check if the row is aligned, press enter to continue...")
+                input()
+
+        self.__board_calibrated_cols.add(index)
+
+    # Returns the position of a gameboard column for the given drop phase
+    def __board_pose(self, index, phase: BoardPhase) -> PoseObject:
+        return self.__board_pos[index * 2 + phase.value]
+
     @contextmanager
     def __slow_arm_control(self, slow_speed=30):
         self.__logger.info("Arm is moving slowly for precise action")
-        
+
+        # Queued moves must run with the speed they were queued with
+        self.__flush_poses()
+
         slow_arm = self.__arm
         self.__execute_robot_action(
             slow_arm.set_arm_max_velocity, slow_speed
@@ -539,6 +779,7 @@ class Robot:
         try:
             yield slow_arm
         finally:
+            self.__flush_poses()
             self.__execute_robot_action(
                 slow_arm.set_arm_max_velocity, 100
             )
@@ -567,8 +808,6 @@ def __robotTest(args):
             row_info.append(current_row)
 
         while original_piece:
-            robot_ethernet.grab_piece()
-
             chosen_index = randrange(len(row_info))
             chosen_row = row_info[chosen_index]["val"]
 
@@ -579,12 +818,16 @@ def __robotTest(args):
 
             original_piece -= 1
 
-            robot_ethernet.drop_piece_to_board(chosen_row)
+            # Only go home after the last piece
+            robot_ethernet.drop_piece_to_board(chosen_row, return_home=(original_piece == 0))
             # robot_ethernet.drop_piece_to_board(0)
 
     except KeyboardInterrupt:
         test_logger.info("Program ended with keyboard interrupt")
         sys.exit(130)
+    except RobotActionTimeout:
+        test_logger.exception("Robot stopped responding, test aborted")
+        sys.exit(1)
     finally:
         robot_ethernet.end_robot()
 